@@ -2,11 +2,22 @@
 """
 
 import argparse
-import json
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from datetime import timedelta
+import functools
+from io import StringIO
 import logging
+import os
+import re
+from types import MappingProxyType
 
+import lxml.html
+import orjson
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+from urllib3.util.retry import Retry
 
 
 LOGGER = logging.getLogger('iso_3166_data_scrape')
@@ -17,19 +28,96 @@ LOGGER.addHandler(handler)
 logging.captureWarnings(True)
 LOGGER.setLevel(logging.INFO)
 
+MAX_WORKERS = 16
+REQUEST_TIMEOUT = 30
+BRACKETED_TEXT_REGEX = re.compile(r'\[[^\]]*\]')
+WHITESPACE_REGEX = re.compile(r'\s+')
+INTEGER_REGEX = re.compile(r'[+-]?[0-9]+')
+# only the rows of the table itself, not those of tables nested in its cells
+TABLE_ROWS_XPATH = './tr|./thead/tr|./tbody/tr|./tfoot/tr'
+WIKITABLE_XPATH = '//table[contains(concat(" ", normalize-space(@class), " "), " wikitable ")]'
+CLEAN_COLUMN_NAME_TRANSLATION_TABLE = str.maketrans({' ': '_', '-': '_', '/': '_', '(': '', ')': ''})
+USER_AGENT = 'iso_3166_data_scraper (https://github.com/bcope/iso_3166_data_scraper)'
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+PROGRESS_FILE_SUFFIX = '.progress.jsonl'
+CACHE_NAME = '.cache/wiki'
+CACHE_EXPIRE_AFTER = timedelta(days=7)
+
+
+@functools.lru_cache(maxsize=None)
+def get_session():
+    """Returns the session shared by all requests, creating it (and the cache database in
+    CACHE_NAME) on the first call. The first call is made from main() before any worker threads
+    start. Cached responses expire after CACHE_EXPIRE_AFTER regardless of the Cache-Control headers
+    sent by Wikipedia, which would otherwise make every request revalidate.
 
-def get_dataframes_from_url(url):
-    """Gets the html from the URL and uses Pandas to retrieve the tables from the html as DataFrames
+    Returns:
+        requests_cache.CachedSession
+    """
+    session = CachedSession(
+        CACHE_NAME,
+        backend='sqlite',
+        expire_after=CACHE_EXPIRE_AFTER,
+        cache_control=False,
+    )
+    session.headers.update({'User-Agent': USER_AGENT})
+    session.mount('https://', HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=MAX_WORKERS,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504]),
+    ))
+    return session
+
+
+def get_html_from_url(url):
+    """Gets the html from the URL
 
     Args:
         url (str): a url string
 
     Returns:
-        list[pandas.DataFrame]: a list of DataFrames each containing the data from an html table
+        str: the html of the page
+    """
+    response = get_session().get(url, timeout=REQUEST_TIMEOUT)
+    return response.text
+
+
+def get_tables_containing_string_from_html(html, string):
+    """Parse the html once and return the wikitable elements whose text contains the given string
+    (case-insensitive).
+
+    Args:
+        html (str): the html of a page
+        string (str): the text that a table must contain
+
+    Returns:
+        list[lxml.html.HtmlElement]: the matching table elements in page order
     """
-    response = requests.get(url)
-    dataframes = pd.read_html(response.text)
-    LOGGER.debug(f"Retrieved {len(dataframes)} DataFrames from {url}")
+    tree = lxml.html.fromstring(html)
+    lowercase_string = string.lower()
+    return [t for t in tree.xpath(WIKITABLE_XPATH) if lowercase_string in t.text_content().lower()]
+
+
+def get_dataframes_from_html(html, string=''):
+    """Uses Pandas to retrieve the wikitables from the html that contain the given string as
+    DataFrames. Only the matching table fragments are passed to Pandas so no DataFrames are built
+    for the other tables on the page.
+
+    Args:
+        html (str): the html of a page
+        string (str): the text that a table must contain, by default all wikitables are returned
+
+    Returns:
+        list[pandas.DataFrame]: a list of DataFrames each containing the data from an html table or
+            an empty list if no tables match
+    """
+    dataframes = []
+    for table in get_tables_containing_string_from_html(html, string):
+        table_html = lxml.html.tostring(table, encoding='unicode', with_tail=False)
+        try:
+            dataframes.extend(pd.read_html(StringIO(table_html), flavor='lxml'))
+        except ValueError as e:
+            LOGGER.debug(f"Could not convert table to a DataFrame: {e}")
     return dataframes
 
 
@@ -77,89 +165,61 @@ def get_first_dataframe_with_matching_column_name_from_list(dataframes, column_n
         pandas.DataFrame or None: returns the first matching DataFrame or None if no exact or fuzzy
             matches
     """
-    for df in dataframes:
-        for column in df.columns.to_list():
-            if column_name.lower() == str(column).lower():
-                LOGGER.debug(f"DataFrame found with exact match of '{column_name}'")
-                return df
-    for df in dataframes:
-        for column in df.columns.to_list():
-            if column_name.lower() in str(column).lower():
-                LOGGER.debug(f"DataFrame found with column name containing of '{column_name}'")
-                return df
+    lowercase_column_name = column_name.lower()
+    lowercase_column_name_index = construct_lowercase_column_name_index(dataframes)
+    dataframe_index = lowercase_column_name_index.get(lowercase_column_name)
+    if dataframe_index is not None:
+        LOGGER.debug(f"DataFrame found with exact match of '{column_name}'")
+        return dataframes[dataframe_index]
+    for lowercase_column, dataframe_index in lowercase_column_name_index.items():
+        if lowercase_column_name in lowercase_column:
+            LOGGER.debug(f"DataFrame found with column name containing of '{column_name}'")
+            return dataframes[dataframe_index]
     return None
 
 
-def string_is_name_of_at_least_one_column(df, string):
-    """Performs a case-insensitive check to see if given string is an exact column name of the
-    given DataFrame.
-
-    Args:
-        df (pandas.DataFrame): a Pandas DataFrame
-        string (str): a string that is compared against the column names of the DataFrame
-
-    Returns:
-        boolean
-    """
-    columns = [c.lower() for c in df.columns.to_list()]
-    return True if string.lower() in columns else False
-
+def construct_lowercase_column_name_index(dataframes):
+    """Map every lowercase column name found in the DataFrames to the position of the first
+    DataFrame that has it. Keys are in order of first appearance, so iterating over the index
+    visits the DataFrames in list order.
 
-def get_first_column_name_matching_string(df, string):
-    """Returns the name of the first column that matches the given string in a case-insensitive
-    search
-    
     Args:
-        df (pandas.DataFrame): a Pandas DataFrame
-        string (str): a string that is compared against the column names of the DataFrame
-    
-    Returns:
-        str or None: returns the name of the column if one is found otherwise returns None
-    """
-    for column in df.columns.to_list():
-        if string.lower() == str(column).lower():
-            return column
-    return None
-
-
-def get_column_names_containing_string(df, string):
-    """Returns a list of all column names that contain the given string (case-insensitve)
-    
-    Args:
-        df (pandas.DataFrame): a Pandas DataFrame
-        string (str): a string that is compared against the column names of the DataFrame
+        dataframes (list[pandas.DataFrame]): a list of Pandas DataFrames
 
     Returns:
-        list: returns a list with matching column names
+        dict: lowercase column names as keys and DataFrame list positions as values
     """
-    matching_column_names = []
-    for column in df.columns.to_list():
-        if string.lower() in str(column).lower():
-            matching_column_names.append(column)
-    return matching_column_names
+    lowercase_column_name_index = {}
+    for i, df in enumerate(dataframes):
+        for column in df.columns:
+            lowercase_column_name_index.setdefault(str(column).lower(), i)
+    return lowercase_column_name_index
 
 
 def get_best_matching_column_name_compared_to_string(df, string):
     """Attempt to find the column name that best matches a given string or return None if no
-    column satisfies matching criteria.
+    column satisfies matching criteria. A case-insensitive exact match is preferred, otherwise the
+    first column name containing the string is returned. The columns are scanned once.
 
     Args:
         df (pandas.DataFrame): a Pandas DataFrame
-        string (str): a 
+        string (str): a string that is compared against the column names of the DataFrame
 
     Returns:
         obj or None: the column name value or None
     """
-    # case-insensitive exact match
-    if string_is_name_of_at_least_one_column(df, string):
-        LOGGER.debug(f"Column identified with exact match of '{string}'")
-        return get_first_column_name_matching_string(df, string)
-    # just go with first fuzzy match
-    column_names_containing_string = get_column_names_containing_string(df, string)
-    if column_names_containing_string:
-        LOGGER.debug(f"Column identified with fuzzy match of '{string}'. All possible matches: {column_names_containing_string}")
-        return column_names_containing_string[0]
-    return None
+    lowercase_string = string.lower()
+    first_fuzzy_match = None
+    for column in df.columns:
+        lowercase_column = str(column).lower()
+        if lowercase_column == lowercase_string:
+            LOGGER.debug(f"Column identified with exact match of '{string}'")
+            return column
+        if first_fuzzy_match is None and lowercase_string in lowercase_column:
+            first_fuzzy_match = column
+    if first_fuzzy_match is not None:
+        LOGGER.debug(f"Column identified with fuzzy match of '{string}': '{first_fuzzy_match}'")
+    return first_fuzzy_match
 
 
 def has_multi_index_columns(df):
@@ -171,10 +231,7 @@ def has_multi_index_columns(df):
     Returns:
         boolean
     """
-    for column in df.columns.to_list():
-        if isinstance(column, tuple):
-            return True
-    return False
+    return isinstance(df.columns, pd.MultiIndex)
 
 
 def collapse_multi_index_columns_if_exist(df):
@@ -194,56 +251,21 @@ def collapse_multi_index_columns_if_exist(df):
     return df
 
 
-def string_has_bracketed_text(string):
-    """Check if a string has both an open and close bracket. Does not check if brackets exist in 
-    pairs or in logical order.
-
-    Args:
-        string (str)
-
-    Returns:
-        boolean
-    """
-    return bool('[' in string and ']' in string)
-
-
-def remove_first_instance_of_bracketed_text_from_string(string):
-    """Removes the brackets and all text in between. If brackets are not in logical order this will
-    fail.
+@functools.lru_cache(maxsize=None)
+def remove_bracketed_text_from_string(string):
+    """Removes every instance of bracketed text (including the brackets) from the string in a single
+    pass. A close bracket with no preceding open bracket is left in place.
 
     Args:
         string (str)
 
     Returns:
-        str: the string with the first instance of bracketed text removed
-
-    Raises:
-        IndexError: raises an error if the close bracket occurs before the open bracket
+        str: the string with all bracketed text removed
     """
-    open_bracket_index = string.index('[')
-    close_bracket_index = string.index(']')
-    if close_bracket_index < open_bracket_index:
-        raise IndexError(f"The next close bracket at index {close_bracket_index} came before the next open bracket at index {open_bracket_index}")
-    return f"{string[:open_bracket_index]}{string[close_bracket_index + 1:]}"
-
-
-def remove_bracketed_text_from_string(string):
-    """Loops while string contains brackets and removes first instance of bracketed text one at a 
-    time until they are all removed. If brackets are not pai
-    """
-    more_bracketed_text_to_remove = True
-    while more_bracketed_text_to_remove:
-        if not string_has_bracketed_text(string):
-            more_bracketed_text_to_remove = False
-        else:
-            try:
-                string = remove_first_instance_of_bracketed_text_from_string(string)
-            except IndexError as e:
-                LOGGER.warning(f"Failed to remove all bracketed text from string '{string}': {e}")
-                more_bracketed_text_to_remove = False
-    return string
+    return BRACKETED_TEXT_REGEX.sub('', string)
 
 
+@functools.lru_cache(maxsize=None)
 def clean_column_name(value):
     """Convert the value to a str, replace concept separating characters with underscores, remove
     parenthesis, remove bracketed text.
@@ -255,7 +277,7 @@ def clean_column_name(value):
         str: a string that is in snake_case
     """
     return remove_bracketed_text_from_string(
-        str(value).lower().replace(' ', '_').replace('-', '_').replace('/', '_').replace(')(', '_').replace('(', '').replace(')', '')
+        str(value).lower().replace(')(', '_').translate(CLEAN_COLUMN_NAME_TRANSLATION_TABLE)
     )
 
 
@@ -269,14 +291,14 @@ def drop_columns_if_columns_exist(df, columns_to_drop):
     Returns:
         pandas.DataFrame: returns the updated DataFrame
     """
-    for column in columns_to_drop:
-        try:
-            df = df.drop(columns=[column])
-            LOGGER.debug(f"Dropped column '{column}'")
-        except KeyError as e:
-            LOGGER.debug(f"Could not drop column '{column}'")
-            continue
-    return df
+    present_columns = [c for c in columns_to_drop if c in df.columns]
+    missing_columns = [c for c in columns_to_drop if c not in present_columns]
+    if missing_columns:
+        LOGGER.debug(f"Could not drop columns {missing_columns}")
+    if not present_columns:
+        return df
+    LOGGER.debug(f"Dropped columns {present_columns}")
+    return df.drop(columns=present_columns)
 
 
 def add_code_column_to_dataframe(df, primary_key_name):
@@ -291,17 +313,40 @@ def add_code_column_to_dataframe(df, primary_key_name):
     Returns:
         pandas.DataFrame: returns the updated DataFrame
     """
-    if primary_key_name in df.columns.to_list():
+    columns = df.columns.to_list()
+    cleaned_primary_key_name = clean_column_name(primary_key_name)
+    if primary_key_name in columns:
         data_column_name = primary_key_name
-    elif clean_column_name(primary_key_name) in df.columns.to_list():
-        data_column_name = clean_column_name(primary_key_name)
+    elif cleaned_primary_key_name in columns:
+        data_column_name = cleaned_primary_key_name
     else:
-        data_column_name = df.columns.to_list()[0]
+        data_column_name = columns[0]
     df['code'] = df[data_column_name]
     return df
 
 
-def apply_all_updates_to_dataframe_columns(df, handling_map={}):
+def construct_column_rename_map(columns, pre_clean_rename_columns=None, post_clean_rename_columns=None):
+    """Compose renaming, cleaning and renaming again into a single mapping so that the DataFrame
+    only needs to be renamed once.
+
+    Args:
+        columns (iterable): the current column names
+        pre_clean_rename_columns (dict): renames applied to the column names before cleaning
+        post_clean_rename_columns (dict): renames applied to the cleaned column names
+
+    Returns:
+        dict: the current column names as keys and the final column names as values
+    """
+    pre_clean_rename_columns = pre_clean_rename_columns or {}
+    post_clean_rename_columns = post_clean_rename_columns or {}
+    column_rename_map = {}
+    for column in columns:
+        cleaned_column = clean_column_name(pre_clean_rename_columns.get(column, column))
+        column_rename_map[column] = post_clean_rename_columns.get(cleaned_column, cleaned_column)
+    return column_rename_map
+
+
+def apply_all_updates_to_dataframe_columns(df, handling_map=None):
     """Sort data based on primary key column, drop columns, rename columns, flatten multi-index 
     columns, clean column names, rename columns again, and drop columns again.
 
@@ -313,46 +358,38 @@ def apply_all_updates_to_dataframe_columns(df, handling_map={}):
             rename_columns (dict): the original column name as keys and the new column names as
                 values
             drop_columns (list): columns to be dropped
+            Defaults to DEFAULT_HANDLING_MAP.
     
     Returns:
         pandas.DataFrame: the updated DataFrame
     """
-    LOGGER.debug(f"columns: {df.columns.to_list()}")
+    handling_map = handling_map or DEFAULT_HANDLING_MAP
+    LOGGER.debug(f"columns: {list(df.columns)}")
     try:
         df = df.sort_values(handling_map.get('primary_key_name'), axis=0)
     except ValueError as e:
         LOGGER.warning(f"Failed to sort table due to ValueError: {e}")
     if handling_map.get('drop_columns'):
         df = drop_columns_if_columns_exist(df, handling_map.get('drop_columns'))
-    if handling_map.get('rename_columns'):
-        df = df.rename(columns=handling_map.get('rename_columns'))
-    df = collapse_multi_index_columns_if_exist(df)
-    clean_column_map = {c: clean_column_name(c) for c in df.columns.to_list()}
-    df = df.rename(columns=clean_column_map)
-    if handling_map.get('rename_columns'):
-        df = df.rename(columns=handling_map.get('rename_columns'))
-    if 'code' not in df.columns.to_list():
+    rename_columns = handling_map.get('rename_columns') or {}
+    if has_multi_index_columns(df):
+        # the renames have to be applied to the labels of each level before they are collapsed
+        if rename_columns:
+            df = df.rename(columns=rename_columns)
+        df = collapse_multi_index_columns_if_exist(df)
+        column_rename_map = construct_column_rename_map(
+            df.columns, post_clean_rename_columns=rename_columns
+        )
+    else:
+        column_rename_map = construct_column_rename_map(df.columns, rename_columns, rename_columns)
+    df = df.rename(columns=column_rename_map)
+    if 'code' not in df.columns:
         df = add_code_column_to_dataframe(df, primary_key_name=handling_map.get('primary_key_name'))
     if handling_map.get('drop_columns'):
         df = drop_columns_if_columns_exist(df, handling_map.get('drop_columns'))
     return df
 
 
-def fix_namibia_country_code(df):
-    """When the HTML table for the ISO 3166-1 data is parsed, the country code for Namibia 'NA'
-    gets parsed into NaN. This function finds that row and corrects that data point.
-    
-    Args:
-        df (pandas.DataFrame): a Pandas DataFrame containing the ISO 3166-1 with a column named 
-            'code' and a column named 'name_en'
-
-    Returns:
-        pandas.DataFrame: returns the updated DataFrame
-    """
-    df['code'] = df.apply(lambda x: 'NA' if x['name_en'] == 'Namibia' else x['code'], axis=1)
-    return df
-
-
 def convert_dataframe_to_dict(df):
     """Transform the DataFrame to a dictionary with keys of the values from the primary key column
     and values of dictionarys of the row data.
@@ -363,7 +400,13 @@ def convert_dataframe_to_dict(df):
     Returns:
         dict
     """
-    data_dict = {i['code']: i for i in df.to_dict(orient='records')}
+    # columns can clean to the same name (e.g. 'Code' and 'Code[note 1]'), keep the last of each
+    # like the records comprehension this replaced did
+    df = df.loc[:, ~df.columns.duplicated(keep='last')]
+    if not df['code'].is_unique:
+        # orient='index' requires unique keys, keep the last row for each code
+        df = df.drop_duplicates(subset='code', keep='last')
+    data_dict = df.set_index('code', drop=False).to_dict(orient='index')
     return data_dict
 
 
@@ -376,9 +419,9 @@ PRIMARY_TABLE_HANDLING_MAP = {
         'Link to ISO 3166-2 subdivision codes': 'iso_3166_2_name',
     }
 }
-DEFAULT_HANDLING_MAP = {
+DEFAULT_HANDLING_MAP = MappingProxyType({
     'primary_key_name': 'Code'
-}
+})
 COUNTRY_SPECIFIC_HANDLING_MAP = {
     # add country codes as keys and subdivision caption as value
     'CN': {
@@ -392,19 +435,31 @@ DATA_TO_EXCLUDE_TABLES_USING_ILOC_COMPARISON = [
 ]
 
 
+# the country specific maps merged over the default map, built once rather than for every country
+MERGED_COUNTRY_SPECIFIC_HANDLING_MAP = {
+    country_code: MappingProxyType({**DEFAULT_HANDLING_MAP, **country_map})
+    for country_code, country_map in COUNTRY_SPECIFIC_HANDLING_MAP.items()
+}
+
+
 def construct_country_specific_handling_map(country_code):
-    handling_map = DEFAULT_HANDLING_MAP.copy()
-    country_map = COUNTRY_SPECIFIC_HANDLING_MAP.get(country_code)
-    if country_map:
-        handling_map.update(country_map)
-    return handling_map
+    """Returns the handling map for a country, which is the default map updated with anything in
+    COUNTRY_SPECIFIC_HANDLING_MAP for that country. The returned map is read-only and shared.
+
+    Args:
+        country_code (str): the ISO 3166-1 alpha-2 code of the country
+
+    Returns:
+        mappingproxy: the handling map
+    """
+    return MERGED_COUNTRY_SPECIFIC_HANDLING_MAP.get(country_code, DEFAULT_HANDLING_MAP)
 
 
 def get_dataframe_from_url(url, primary_key_name):
-    """Convenience function to process several functions in succession. Gets all tables as Pandas
-    DataFrames from the url, filters out DataFrames based on criteria from 
-    DATA_TO_EXCLUDE_TABLES_USING_ILOC_COMPARISON, and then selects the first matching DataFrame if
-    any match.
+    """Convenience function to process several functions in succession. Gets all wikitables
+    mentioning the primary_key_name as Pandas DataFrames from the url, filters out DataFrames based
+    on criteria from DATA_TO_EXCLUDE_TABLES_USING_ILOC_COMPARISON, and then selects the first
+    matching DataFrame if any match.
 
     Args:
         url (str): a url string
@@ -415,7 +470,11 @@ def get_dataframe_from_url(url, primary_key_name):
         pandas.DataFrame or None: returns the table from the url that best matches given the 
             primary_key_name or returns None if there are no matching tables
     """
-    dfs = get_dataframes_from_url(url)
+    html = get_html_from_url(url)
+    dfs = get_dataframes_from_html(html, primary_key_name)
+    LOGGER.debug(f"Retrieved {len(dfs)} DataFrames from {url}")
+    # the navbox footers aren't wikitables so they are no longer parsed, these filters are kept as a
+    # safety net for pages that put such a table in a wikitable
     for filter_criterion in DATA_TO_EXCLUDE_TABLES_USING_ILOC_COMPARISON:
         dfs = filter_out_dataframes_with_specific_iloc_values(
             dfs,
@@ -427,41 +486,308 @@ def get_dataframe_from_url(url, primary_key_name):
     return df
 
 
+def normalize_whitespace(string):
+    """Collapse every run of whitespace (including newlines) into a single space and strip the ends,
+    the same way Pandas does when it reads html tables.
+
+    Args:
+        string (str)
+
+    Returns:
+        str
+    """
+    return WHITESPACE_REGEX.sub(' ', string).strip()
+
+
+def get_table_cell_text(cell):
+    """Returns the text of a table cell with footnote references removed and whitespace normalized
+
+    Args:
+        cell (lxml.html.HtmlElement): a th or td element
+
+    Returns:
+        str
+    """
+    return normalize_whitespace(BRACKETED_TEXT_REGEX.sub('', cell.text_content()))
+
+
+def get_cell_span(cell, attribute):
+    """Returns the colspan or rowspan of a table cell, defaulting to 1 if missing or invalid
+
+    Args:
+        cell (lxml.html.HtmlElement): a th or td element
+        attribute (str): 'colspan' or 'rowspan'
+
+    Returns:
+        int
+    """
+    try:
+        return max(int(cell.get(attribute, 1)), 1)
+    except ValueError:
+        return 1
+
+
+def expand_spanning_cells(rows):
+    """Expand cells with colspan or rowspan so that every position they cover holds the cell, the
+    same way Pandas fills merged cells in when it reads html tables.
+
+    Args:
+        rows (list[lxml.html.HtmlElement]): the tr elements of a table
+
+    Returns:
+        list[list[lxml.html.HtmlElement]]: the cells of each row after expansion
+    """
+    expanded_rows = []
+    # column position -> (cell, number of following rows it still covers)
+    row_spanning_cells = {}
+    for row in rows:
+        cells = iter(row.xpath('./th|./td'))
+        expanded_row = []
+        while True:
+            column = len(expanded_row)
+            if column in row_spanning_cells:
+                cell, remaining_rows = row_spanning_cells.pop(column)
+                if remaining_rows > 1:
+                    row_spanning_cells[column] = (cell, remaining_rows - 1)
+                expanded_row.append(cell)
+                continue
+            cell = next(cells, None)
+            if cell is None:
+                break
+            rowspan = get_cell_span(cell, 'rowspan')
+            for _ in range(get_cell_span(cell, 'colspan')):
+                if rowspan > 1:
+                    row_spanning_cells[len(expanded_row)] = (cell, rowspan - 1)
+                expanded_row.append(cell)
+        expanded_rows.append(expanded_row)
+    return expanded_rows
+
+
+def get_header_and_rows_from_table(table):
+    """Read the header and the data rows of an html table. The first row is used as the header and
+    merged cells are expanded. Rows with fewer cells than the header are padded with None and rows
+    with more cells are skipped with a warning.
+
+    Args:
+        table (lxml.html.HtmlElement): a table element
+
+    Returns:
+        tuple: a list of the header names and a list of rows, each a list of cell values (text, or
+            int for integer columns)
+    """
+    rows = expand_spanning_cells(table.xpath(TABLE_ROWS_XPATH))
+    if not rows:
+        return [], []
+    header = [normalize_whitespace(cell.text_content()) for cell in rows[0]]
+    data_rows = []
+    for cells in rows[1:]:
+        row = [get_table_cell_text(cell) for cell in cells]
+        if len(row) > len(header):
+            LOGGER.warning(f"Skipped a row with {len(row)} cells in a table with {len(header)} columns: {row}")
+            continue
+        # like Pandas, pad short rows rather than lose them
+        data_rows.append(row + [None] * (len(header) - len(row)))
+    return header, convert_integer_columns(data_rows)
+
+
+def convert_integer_columns(rows):
+    """Convert the columns in which every value is an integer (e.g. '004') to int, the same as the
+    type inference Pandas applies to html tables, so the values match the subdivision data.
+
+    Args:
+        rows (list[list]): rows of cell text of equal length
+
+    Returns:
+        list[list]: the rows with the values of integer columns converted
+    """
+    if not rows:
+        return rows
+    integer_columns = [
+        i for i in range(len(rows[0]))
+        if all(row[i] is not None and INTEGER_REGEX.fullmatch(row[i]) for row in rows)
+    ]
+    for row in rows:
+        for i in integer_columns:
+            row[i] = int(row[i])
+    return rows
+
+
+def get_data_dict_from_url(url, handling_map):
+    """Build the data dictionary straight from the first wikitable at the url that has a column
+    exactly matching the primary key name, without going through Pandas. Column names get the same
+    renaming and cleaning as apply_all_updates_to_dataframe_columns. Integer columns are converted
+    to int as Pandas would, the other cell values are kept as text so codes such as 'NA' (Namibia)
+    aren't converted to NaN.
+
+    Args:
+        url (str): a url string
+        handling_map (dict): a dictionary with the keys described in
+            apply_all_updates_to_dataframe_columns, primary_key_name is required
+
+    Returns:
+        dict: the row data keyed and sorted by the primary key
+
+    Raises:
+        ValueError: raises an error if no table has a column matching the primary key name
+    """
+    primary_key_name = handling_map['primary_key_name']
+    rename_columns = handling_map.get('rename_columns') or {}
+    drop_columns = handling_map.get('drop_columns') or []
+    html = get_html_from_url(url)
+    for table in get_tables_containing_string_from_html(html, primary_key_name):
+        header, rows = get_header_and_rows_from_table(table)
+        lowercase_header = [h.lower() for h in header]
+        if primary_key_name.lower() in lowercase_header:
+            break
+    else:
+        raise ValueError(f"Did not find table with column name '{primary_key_name}' at {url}")
+    primary_key_index = lowercase_header.index(primary_key_name.lower())
+    column_rename_map = construct_column_rename_map(header, rename_columns, rename_columns)
+    columns = [
+        (i, column_rename_map[h]) for i, h in enumerate(header)
+        if h not in drop_columns and column_rename_map[h] not in drop_columns
+    ]
+    records = []
+    for row in rows:
+        record = {column: row[i] for i, column in columns}
+        record.setdefault('code', row[primary_key_index])
+        records.append(record)
+    # rows without a code go last, as they did when Pandas sorted NaN codes
+    records.sort(key=lambda record: (record['code'] is None, record['code'] or ''))
+    return {record['code']: record for record in records}
+
+
+def fetch_country(country_code):
+    """Retrieve and process the subdivision table for a single country. Safe to run from a worker
+    thread as the only shared state is the requests Session. Network errors (including running out
+    of retries) are returned as the error message rather than raised so they don't stop the other
+    countries.
+
+    Args:
+        country_code (str): the ISO 3166-1 alpha-2 code of the country
+
+    Returns:
+        tuple: the country code and either the processed pandas.DataFrame or an error message str
+    """
+    LOGGER.info(f"Retrieving subdivision data for {country_code}")
+    handling_map = construct_country_specific_handling_map(country_code)
+    url = f"https://en.wikipedia.org/wiki/ISO_3166-2:{country_code}"
+    try:
+        cdf = get_dataframe_from_url(url, handling_map['primary_key_name'])
+    except requests.RequestException as e:
+        error_message = f"Failed to retrieve {url}: {e}"
+        LOGGER.error(f"Failed: {error_message}\n")
+        return country_code, error_message
+    if cdf is None:
+        error_message = f"Did not find table with column name '{handling_map['primary_key_name']}' at {url}"
+        LOGGER.error(f"Failed: {error_message}\n")
+        return country_code, error_message
+    cdf = apply_all_updates_to_dataframe_columns(cdf, handling_map=handling_map)
+    LOGGER.info(f"Successfully downloaded subdivision data for {country_code}\n")
+    return country_code, cdf
+
+
+def read_progress_file(progress_file_path):
+    """Read the JSON lines written by a previous run and return those of the countries that were
+    completed. Countries recorded with subdivision_data_retrieval_errors are left out so they are
+    retried. A line that can't be parsed (e.g. one that was only partially written when the run was
+    interrupted) and everything after it is discarded.
+
+    Args:
+        progress_file_path (str): the path of the progress file
+
+    Returns:
+        dict: country codes as keys and their lines (bytes ending with a newline) as values, empty
+            if the file does not exist
+    """
+    completed_progress_lines = {}
+    if not os.path.exists(progress_file_path):
+        return completed_progress_lines
+    with open(progress_file_path, 'rb') as f:
+        for line in f:
+            try:
+                country_code, country_data = next(iter(orjson.loads(line).items()))
+            except (orjson.JSONDecodeError, AttributeError, StopIteration):
+                LOGGER.warning(f"Discarding incomplete progress from {progress_file_path}")
+                break
+            if 'subdivision_data_retrieval_errors' in country_data:
+                continue
+            completed_progress_lines[country_code] = line if line.endswith(b'\n') else line + b'\n'
+    return completed_progress_lines
+
+
+def write_json_from_progress_file(progress_file_path, output_file_path, country_codes):
+    """Combine the single-country JSON objects of the progress file into one JSON object written
+    to the output file. The lines are written in the order of country_codes, which doesn't depend on
+    the order the countries completed in, and any other countries follow in file order.
+
+    Args:
+        progress_file_path (str): the path of the progress file
+        output_file_path (str): the path of the JSON file to write
+        country_codes (list[str]): the order to write the countries in
+    """
+    members = {}
+    with open(progress_file_path, 'rb') as progress_file:
+        for line in progress_file:
+            # each line is an object with a single key, so dropping its braces leaves a member
+            members[next(iter(orjson.loads(line)))] = line.rstrip(b'\n')[1:-1]
+    ordered_country_codes = [c for c in country_codes if c in members]
+    ordered_country_codes_set = set(ordered_country_codes)
+    ordered_country_codes += [c for c in members if c not in ordered_country_codes_set]
+    with open(output_file_path, 'wb') as f:
+        f.write(b'{')
+        f.write(b','.join(members[c] for c in ordered_country_codes))
+        f.write(b'}')
+
+
 def main(args):
 
     # TODO: finish this to enable the user to set the log level
     if args.debug:
         LOGGER.setLevel(logging.DEBUG)
 
+    if args.no_cache:
+        LOGGER.info(f"Clearing cached responses in {CACHE_NAME}")
+        get_session().cache.clear()
+
     # get main ISO 3166 data
-    df = get_dataframe_from_url(URL, PRIMARY_TABLE_HANDLING_MAP['primary_key_name'])
-    df = apply_all_updates_to_dataframe_columns(df, handling_map=PRIMARY_TABLE_HANDLING_MAP)
-    df = fix_namibia_country_code(df)
-    data_dict = convert_dataframe_to_dict(df)
-
-    # retrieve subdivision data
-    for country_code, country_data in data_dict.items():
-        LOGGER.info(f"Retrieving subdivision data for {country_code}")
-        handling_map = construct_country_specific_handling_map(country_code)
-        url = f"https://en.wikipedia.org/wiki/ISO_3166-2:{country_code}"
-        cdf = get_dataframe_from_url(url, handling_map['primary_key_name'])
-        if cdf is None:
-            error_message = f"Did not find table with column name '{handling_map['primary_key_name']}' at {url}"
-            data_dict[country_code]['subdivision_data_retrieval_errors'] = []
-            data_dict[country_code]['subdivision_data_retrieval_errors'].append(error_message)
-            LOGGER.error(f"Failed: {error_message}\n")
-            continue
-        cdf = apply_all_updates_to_dataframe_columns(cdf, handling_map=handling_map)
-        data_dict[country_code]['subdivision_data'] = convert_dataframe_to_dict(cdf)
-        LOGGER.info(f"Successfully downloaded subdivision data for {country_code}\n")
+    data_dict = get_data_dict_from_url(URL, PRIMARY_TABLE_HANDLING_MAP)
+
+    # resume from the progress file of a previous run that did not finish
+    progress_file_path = f"{args.output_file_path}{PROGRESS_FILE_SUFFIX}"
+    completed_progress_lines = read_progress_file(progress_file_path)
+    if completed_progress_lines:
+        LOGGER.info(f"Resuming with {len(completed_progress_lines)} countries already retrieved in {progress_file_path}")
+    country_codes = [c for c in data_dict if c not in completed_progress_lines]
+
+    # retrieve subdivision data, writing each country to the progress file as soon as it completes
+    with open(progress_file_path, 'wb') as progress_file:
+        progress_file.writelines(completed_progress_lines.values())
+        progress_file.flush()
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = [executor.submit(fetch_country, c) for c in country_codes]
+            try:
+                for future in as_completed(futures):
+                    country_code, cdf_or_error = future.result()
+                    country_data = dict(data_dict[country_code])
+                    if isinstance(cdf_or_error, str):
+                        country_data['subdivision_data_retrieval_errors'] = [cdf_or_error]
+                    else:
+                        country_data['subdivision_data'] = convert_dataframe_to_dict(cdf_or_error)
+                    LOGGER.debug(f"data for {country_code}:\n{country_data}")
+                    progress_file.write(orjson.dumps({country_code: country_data}, option=ORJSON_OPTIONS))
+                    progress_file.write(b'\n')
+                    progress_file.flush()
+            except BaseException:
+                # don't start the queued fetches, the completed ones are already in the progress file
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
 
-    LOGGER.debug(f"data:\n{data_dict}")
-    
     LOGGER.info(f"Done scraping data for all countries\n\n")
-    
+
     LOGGER.info(f"Writing file to {args.output_file_path}")
-    with open(args.output_file_path, 'w') as f:
-        json.dump(data_dict, f)
+    write_json_from_progress_file(progress_file_path, args.output_file_path, list(data_dict))
+    os.remove(progress_file_path)
 
 
 if __name__ == '__main__':
@@ -476,6 +802,14 @@ if __name__ == '__main__':
         action='store_true',
         help='''Optionally set the logging level to debug'''
     )
+    parser.add_argument(
+        '--no-cache',
+        default=False,
+        action='store_true',
+        help='''Optionally clear the cached Wikipedia responses so that every page is downloaded
+        again
+        '''
+    )
     parser.add_argument(
         '--output-file-path',
         default='./data/iso_3166.json',